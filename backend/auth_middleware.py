@@ -1,6 +1,7 @@
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_config import verify_firebase_token
+import profiling
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,7 +13,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """
     try:
         token = credentials.credentials
-        decoded_token = await verify_firebase_token(token)
+        with profiling.span("auth.verify_token"):
+            decoded_token = await verify_firebase_token(token)
         
         if not decoded_token:
             raise HTTPException(
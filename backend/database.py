@@ -1,13 +1,17 @@
 from firebase_config import get_firestore_client
+from firebase_admin import firestore
 from models import User, Chat, Message
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import asyncio
 import logging
+import profiling
 
 logger = logging.getLogger(__name__)
 db = get_firestore_client()
 
 # User operations
+@profiling.profiled("db.create_or_update_user")
 async def create_or_update_user(user_data: dict) -> bool:
     try:
         user_ref = db.collection('users').document(user_data['uid'])
@@ -28,6 +32,7 @@ async def create_or_update_user(user_data: dict) -> bool:
         logger.error(f"Error creating/updating user: {str(e)}")
         return False
 
+@profiling.profiled("db.get_user")
 async def get_user(uid: str) -> Optional[dict]:
     try:
         user_ref = db.collection('users').document(uid)
@@ -41,6 +46,7 @@ async def get_user(uid: str) -> Optional[dict]:
         return None
 
 # Chat operations
+@profiling.profiled("db.create_chat")
 async def create_chat(user_id: str, title: str) -> Optional[str]:
     try:
         chat_data = {
@@ -56,6 +62,7 @@ async def create_chat(user_id: str, title: str) -> Optional[str]:
         logger.error(f"Error creating chat: {str(e)}")
         return None
 
+@profiling.profiled("db.get_user_chats")
 async def get_user_chats(user_id: str) -> List[dict]:
     try:
         chats_ref = db.collection('chats').where('user_id', '==', user_id).order_by('updated_at', direction='DESCENDING')
@@ -72,6 +79,7 @@ async def get_user_chats(user_id: str) -> List[dict]:
         logger.error(f"Error getting user chats: {str(e)}")
         return []
 
+@profiling.profiled("db.delete_chat")
 async def delete_chat(chat_id: str, user_id: str) -> bool:
     try:
         # Verify chat belongs to user
@@ -100,6 +108,7 @@ async def delete_chat(chat_id: str, user_id: str) -> bool:
         return False
 
 # Message operations
+@profiling.profiled("db.save_message")
 async def save_message(chat_id: str, role: str, content: str) -> Optional[str]:
     try:
         message_data = {
@@ -120,6 +129,7 @@ async def save_message(chat_id: str, role: str, content: str) -> Optional[str]:
         logger.error(f"Error saving message: {str(e)}")
         return None
 
+@profiling.profiled("db.get_chat_messages")
 async def get_chat_messages(chat_id: str) -> List[dict]:
     try:
         messages_ref = db.collection('messages').where('chat_id', '==', chat_id).order_by('timestamp')
@@ -136,6 +146,7 @@ async def get_chat_messages(chat_id: str) -> List[dict]:
         logger.error(f"Error getting chat messages: {str(e)}")
         return []
 
+@profiling.profiled("db.update_chat_title")
 async def update_chat_title(chat_id: str, title: str, user_id: str) -> bool:
     try:
         chat_ref = db.collection('chats').document(chat_id)
@@ -155,4 +166,93 @@ async def update_chat_title(chat_id: str, title: str, user_id: str) -> bool:
         return True
     except Exception as e:
         logger.error(f"Error updating chat title: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+# Usage operations
+MAX_BATCH_WRITES = 500
+
+def _usage_increments(totals: dict, counters: Sequence[str]) -> dict:
+    data = {field: firestore.Increment(totals[field]) for field in counters}
+    data['models'] = {
+        model: {field: firestore.Increment(value) for field, value in counters.items()}
+        for model, counters in totals['models'].items()
+    }
+    data['updated_at'] = datetime.now()
+    return data
+
+@profiling.profiled("db.flush_usage")
+async def flush_usage(
+    user_usage: Dict[Tuple[str, str], dict],
+    chat_usage: Dict[str, dict],
+    counters: Sequence[str],
+) -> Set[tuple]:
+    """
+    Apply usage deltas as Firestore increments, in batches of at most 500 writes.
+    Each batch commits atomically; returns the ('user', (user_id, period)) and
+    ('chat', chat_id) keys whose batch was committed. The commits run in a
+    worker thread so they don't block the event loop.
+    """
+    writes = []
+    for (user_id, period), totals in user_usage.items():
+        data = _usage_increments(totals, counters)
+        data.update({'user_id': user_id, 'period': period})
+        ref = db.collection('usage_users').document(user_id).collection('periods').document(period)
+        writes.append((('user', (user_id, period)), ref, data))
+    for chat_id, totals in chat_usage.items():
+        data = _usage_increments(totals, counters)
+        data.update({'chat_id': chat_id, 'user_id': totals['user_id']})
+        writes.append((('chat', chat_id), db.collection('usage_chats').document(chat_id), data))
+    
+    return await asyncio.to_thread(_commit_usage_writes, writes)
+
+def _commit_usage_writes(writes: list) -> Set[tuple]:
+    committed = set()
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        chunk = writes[start:start + MAX_BATCH_WRITES]
+        try:
+            batch = db.batch()
+            for _, ref, data in chunk:
+                batch.set(ref, data, merge=True)
+            batch.commit()
+            committed.update(key for key, _, _ in chunk)
+        except Exception as e:
+            logger.error(f"Error flushing usage: {str(e)}")
+    
+    return committed
+
+@profiling.profiled("db.get_user_usage")
+async def get_user_usage(user_id: str, period: str) -> Optional[dict]:
+    try:
+        usage_ref = db.collection('usage_users').document(user_id).collection('periods').document(period)
+        usage_doc = usage_ref.get()
+        
+        if usage_doc.exists:
+            return usage_doc.to_dict()
+        return {}
+    except Exception as e:
+        logger.error(f"Error getting user usage: {str(e)}")
+        return None
+
+@profiling.profiled("db.get_chat_usage")
+async def get_chat_usage(chat_id: str) -> Optional[dict]:
+    try:
+        usage_doc = db.collection('usage_chats').document(chat_id).get()
+        
+        if usage_doc.exists:
+            return usage_doc.to_dict()
+        return {}
+    except Exception as e:
+        logger.error(f"Error getting chat usage: {str(e)}")
+        return None
+
+@profiling.profiled("db.get_chat_owner")
+async def get_chat_owner(chat_id: str) -> Optional[str]:
+    try:
+        chat_doc = db.collection('chats').document(chat_id).get()
+        
+        if chat_doc.exists:
+            return chat_doc.to_dict().get('user_id')
+        return None
+    except Exception as e:
+        logger.error(f"Error getting chat owner: {str(e)}")
+        return None
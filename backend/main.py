@@ -1,16 +1,20 @@
-from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from groq import Groq
 import os
+import time
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import uvicorn
+from contextlib import asynccontextmanager
 
 # Import our modules
 from models import ChatRequest, NewChatRequest, UserCreateRequest
 from firebase_config import initialize_firebase
 from auth_middleware import get_current_user
 import database as db
+import profiling
+from usage import tracker as usage_tracker, is_valid_period
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,7 +22,14 @@ logger = logging.getLogger(__name__)
 # Initialize Firebase
 initialize_firebase()
 
-app = FastAPI(title="ChatGPT Clone API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    usage_tracker.start()
+    yield
+    await usage_tracker.stop()
+
+app = FastAPI(title="ChatGPT Clone API", version="1.0.0", lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,11 +45,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(profiling.ProfilingMiddleware)
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY environment variable is not set")
 
 client = Groq(api_key=GROQ_API_KEY)
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+async def enforce_token_quota(user_id: str):
+    if not await usage_tracker.check_quota(user_id):
+        raise HTTPException(status_code=429, detail="Monthly token quota exceeded")
+
+def create_completion(groq_messages: List[Dict[str, str]], user_id: str, chat_id: str):
+    """Call Groq and record the token usage of the completion"""
+    started = time.perf_counter()
+    with profiling.span("groq.completion"):
+        response = client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=groq_messages,
+            max_tokens=1000,
+            temperature=0.7,
+            stream=False,
+        )
+    latency_ms = (time.perf_counter() - started) * 1000
+    usage_tracker.record(user_id, chat_id, response.model or GROQ_MODEL, response.usage, latency_ms)
+    return response
 
 # Health check endpoint
 @app.get("/health")
@@ -234,6 +267,8 @@ async def send_message_endpoint(chat_id: str, request: dict, current_user: dict
         if not content:
             raise HTTPException(status_code=400, detail="Message content is required")
         
+        await enforce_token_quota(current_user['uid'])
+        
         # Save user message
         user_msg_id = await db.save_message(chat_id, "user", content)
         
@@ -250,13 +285,7 @@ async def send_message_endpoint(chat_id: str, request: dict, current_user: dict
             {"role": "user", "content": content}
         ]
         
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=groq_messages,
-            max_tokens=1000,
-            temperature=0.7,
-            stream=False,
-        )
+        response = create_completion(groq_messages, current_user['uid'], chat_id)
         
         ai_content = response.choices[0].message.content
         ai_msg_id = await db.save_message(chat_id, "assistant", ai_content)
@@ -286,13 +315,18 @@ async def send_message_endpoint(chat_id: str, request: dict, current_user: dict
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in send_message_endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
 # Main chat endpoint
 @app.post("/api/chat")
-async def chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def chat(
+    current_user: dict = Depends(get_current_user),
+    request: ChatRequest = Depends(profiling.profiled_body(ChatRequest)),
+):
     try:
         # Verify user can only chat for themselves
         if current_user['uid'] != request.user_id:
@@ -302,6 +336,8 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
         if not messages or not isinstance(messages, list):
             raise HTTPException(status_code=400, detail="Invalid or missing 'messages' in request body")
 
+        await enforce_token_quota(request.user_id)
+
         # Create new chat if chat_id is not provided
         chat_id = request.chat_id
         if not chat_id:
@@ -328,13 +364,7 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
         ]
 
         try:
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",  # Updated to a more stable model
-                messages=groq_messages,
-                max_tokens=1000,
-                temperature=0.7,
-                stream=False,
-            )
+            response = create_completion(groq_messages, request.user_id, chat_id)
             content = response.choices[0].message.content
             if not content:
                 raise HTTPException(status_code=500, detail="Empty response from Groq")
@@ -353,5 +383,43 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
         logger.error(f"Request processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+# Usage endpoints
+@app.get("/api/usage")
+async def get_usage_endpoint(period: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    try:
+        if period is not None and not is_valid_period(period):
+            raise HTTPException(status_code=400, detail="Period must be in YYYY-MM format")
+        
+        usage = await usage_tracker.get_user_summary(current_user['uid'], period)
+        return {"success": True, "data": usage}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_usage_endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/chats/{chat_id}/usage")
+async def get_chat_usage_endpoint(chat_id: str, current_user: dict = Depends(get_current_user)):
+    try:
+        # Verify chat belongs to user
+        if await db.get_chat_owner(chat_id) != current_user['uid']:
+            raise HTTPException(status_code=404, detail="Chat not found or access denied")
+        
+        usage = await usage_tracker.get_chat_summary(chat_id)
+        return {"success": True, "data": usage}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_chat_usage_endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Debug endpoints
+@app.get("/api/debug/traces")
+async def get_traces_endpoint(limit: Optional[int] = Query(None, ge=1), x_profile_token: Optional[str] = Header(None)):
+    if not profiling.is_admin_token(x_profile_token):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return {"success": True, "data": profiling.get_recent_traces(limit)}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
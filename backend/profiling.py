@@ -0,0 +1,221 @@
+import asyncio
+import functools
+import hmac
+import os
+import random
+import time
+import uuid
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional, Union
+
+from fastapi import Depends
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+# Admin token that enables profiling through the X-Profile-Token header and guards the debug endpoint
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+# Fraction of requests profiled without the header (0.0 = only on demand)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+# Sampled requests are only kept when they take at least this long
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", "1000"))
+PROFILING_MAX_TRACES = int(os.getenv("PROFILING_MAX_TRACES", "100"))
+
+PROFILE_HEADER = b"x-profile-token"
+
+_current_profile: ContextVar[Optional["Profile"]] = ContextVar("current_profile", default=None)
+recent_traces = deque(maxlen=PROFILING_MAX_TRACES)
+
+
+class Profile:
+    """Span breakdown of a single profiled request"""
+
+    def __init__(self, method: str, path: str, forced: bool):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.forced = forced
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.spans: List[dict] = []
+        self.validation_start: Optional[float] = None
+        self.handler_end: Optional[float] = None
+
+    def add_span(self, name: str, start: float, end: float):
+        self.spans.append({
+            'name': name,
+            'start_ms': round((start - self.start) * 1000, 3),
+            'duration_ms': round((end - start) * 1000, 3),
+        })
+
+    def to_dict(self, status: Optional[int], end: float) -> dict:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'trigger': 'header' if self.forced else 'sample',
+            'started_at': self.started_at.isoformat(),
+            'total_ms': round((end - self.start) * 1000, 3),
+            'spans': sorted(self.spans, key=lambda span: span['start_ms']),
+        }
+
+
+@contextmanager
+def _profiled_span(profile: Profile, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter())
+
+
+@contextmanager
+def _noop_span():
+    yield
+
+
+def span(name: str):
+    """Time the enclosed block as a span of the current request, if it is being profiled"""
+    profile = _current_profile.get()
+    if profile is None:
+        return _noop_span()
+    return _profiled_span(profile, name)
+
+
+def profiled(name: str):
+    """Decorator recording each call of an async function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return await func(*args, **kwargs)
+            with _profiled_span(profile, name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_body(model):
+    """
+    Dependency returning the request body parsed as `model`, recording its
+    validation as a `request.validation` span. Declare it after the auth
+    dependency so the span covers validation alone.
+    """
+    async def start_validation():
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.validation_start = time.perf_counter()
+
+    # FastAPI resolves `start_validation` before validating this dependency's body
+    async def validated_body(body: model, _: None = Depends(start_validation)):
+        profile = _current_profile.get()
+        if profile is not None and profile.validation_start is not None:
+            profile.add_span("request.validation", profile.validation_start, time.perf_counter())
+            profile.validation_start = None
+        return body
+
+    return validated_body
+
+
+def _profiled_handler(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return await func(*args, **kwargs)
+        try:
+            with _profiled_span(profile, "handler"):
+                return await func(*args, **kwargs)
+        finally:
+            profile.handler_end = time.perf_counter()
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that records the endpoint call as a `handler` span"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = _profiled_handler(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def is_admin_token(token: Optional[Union[bytes, str]]) -> bool:
+    """Compare a raw header value (or one decoded as latin-1) to the admin token"""
+    if not PROFILING_ADMIN_TOKEN or token is None:
+        return False
+    try:
+        if isinstance(token, str):
+            token = token.encode("latin-1")
+        return hmac.compare_digest(token, PROFILING_ADMIN_TOKEN.encode())
+    except (TypeError, UnicodeEncodeError):
+        return False
+
+
+def get_recent_traces(limit: Optional[int] = None) -> List[dict]:
+    traces = list(reversed(recent_traces))
+    return traces[:limit] if limit else traces
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware that profiles a request when it carries the admin
+    X-Profile-Token header or is picked by PROFILING_SAMPLE_RATE. Requests
+    that are not profiled are passed straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> Optional[bool]:
+        """Return True when forced by header, False when sampled, None when not profiled"""
+        if PROFILING_ADMIN_TOKEN:
+            for key, value in scope["headers"]:
+                if key == PROFILE_HEADER:
+                    if is_admin_token(value):
+                        return True
+                    break
+        if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+            return False
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        forced = self._should_profile(scope)
+        if forced is None:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["method"], scope["path"], forced)
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                if profile.validation_start is not None:
+                    # Body validation failed: the span includes rendering the 422 response
+                    profile.add_span("request.validation", profile.validation_start, now)
+                elif profile.handler_end is not None:
+                    profile.add_span("response.serialization", profile.handler_end, now)
+                if forced:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            trace = profile.to_dict(status, time.perf_counter())
+            if forced or trace['total_ms'] >= PROFILING_SLOW_MS:
+                recent_traces.append(trace)
+                logger.info(f"Profiled {trace['method']} {trace['path']} in {trace['total_ms']}ms ({trace['id']})")
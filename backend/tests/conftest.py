@@ -0,0 +1,57 @@
+import importlib
+import sys
+
+import pytest
+
+
+class FakeDatabase:
+    """In-memory stand-in for the usage functions of `database`, which connects to Firestore on import"""
+
+    def __init__(self):
+        self.user_usage = {}
+        self.chat_usage = {}
+        self.users = {}
+        self.fail_keys = set()
+        self.user_reads = 0
+
+    async def flush_usage(self, user_usage, chat_usage, counters):
+        committed = set()
+        for key, totals in user_usage.items():
+            if ('user', key) not in self.fail_keys:
+                stored = self.user_usage.setdefault(key, {})
+                for field in counters:
+                    stored[field] = stored.get(field, 0) + totals[field]
+                committed.add(('user', key))
+        for chat_id, totals in chat_usage.items():
+            if ('chat', chat_id) not in self.fail_keys:
+                stored = self.chat_usage.setdefault(chat_id, {})
+                for field in counters:
+                    stored[field] = stored.get(field, 0) + totals[field]
+                committed.add(('chat', chat_id))
+        return committed
+
+    async def get_user_usage(self, user_id, period):
+        return dict(self.user_usage.get((user_id, period), {}))
+
+    async def get_chat_usage(self, chat_id):
+        return dict(self.chat_usage.get(chat_id, {}))
+
+    async def get_user(self, uid):
+        self.user_reads += 1
+        return self.users.get(uid)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setitem(sys.modules, "database", fake)
+    return fake
+
+
+@pytest.fixture
+def usage(fake_db, monkeypatch):
+    """The `usage` module imported against `fake_db`"""
+    monkeypatch.delitem(sys.modules, "usage", raising=False)
+    module = importlib.import_module("usage")
+    yield module
+    sys.modules.pop("usage", None)
@@ -0,0 +1,132 @@
+from typing import Optional
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.testclient import TestClient
+
+import profiling
+from models import ChatRequest
+
+ADMIN_TOKEN = "s3cret"
+
+
+@profiling.profiled("db.save_message")
+async def save_message():
+    return "message-id"
+
+
+async def get_current_user():
+    with profiling.span("auth.verify_token"):
+        return {'uid': "u1"}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.router.route_class = profiling.ProfiledRoute
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+    @app.post("/api/chat")
+    async def chat(
+        current_user: dict = Depends(get_current_user),
+        request: ChatRequest = Depends(profiling.profiled_body(ChatRequest)),
+    ):
+        await save_message()
+        return {"content": "hi", "chat_id": request.chat_id}
+
+    @app.get("/api/debug/traces")
+    async def get_traces_endpoint(limit: Optional[int] = Query(None, ge=1), x_profile_token: Optional[str] = Header(None)):
+        if not profiling.is_admin_token(x_profile_token):
+            raise HTTPException(status_code=403, detail="Access denied")
+        return {"success": True, "data": profiling.get_recent_traces(limit)}
+
+    return app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", ADMIN_TOKEN)
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 0.0)
+    profiling.recent_traces.clear()
+    yield TestClient(build_app())
+    profiling.recent_traces.clear()
+
+
+def span_names(trace):
+    return [span['name'] for span in trace['spans']]
+
+
+def test_admin_header_records_span_breakdown(client):
+    response = client.post(
+        "/api/chat",
+        json={"messages": [{"role": "user", "content": "hello"}], "user_id": "u1"},
+        headers={"X-Profile-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+
+    [trace] = profiling.get_recent_traces()
+    assert response.headers["x-profile-id"] == trace['id']
+    assert trace['status'] == 200
+    assert trace['trigger'] == 'header'
+    assert span_names(trace) == [
+        "auth.verify_token",
+        "request.validation",
+        "handler",
+        "db.save_message",
+        "response.serialization",
+    ]
+
+
+def test_invalid_body_records_only_validation_after_auth(client):
+    response = client.post(
+        "/api/chat",
+        json={"messages": "not a list"},
+        headers={"X-Profile-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 422
+
+    [trace] = profiling.get_recent_traces()
+    assert trace['status'] == 422
+    assert span_names(trace) == ["auth.verify_token", "request.validation"]
+
+
+@pytest.mark.parametrize("token", ["wrong", b"\xe9"])
+def test_bad_token_is_not_profiled_or_admin(client, token):
+    response = client.post(
+        "/api/chat",
+        json={"messages": [], "user_id": "u1"},
+        headers={"X-Profile-Token": token},
+    )
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert profiling.get_recent_traces() == []
+
+    response = client.get("/api/debug/traces", headers={"X-Profile-Token": token})
+    assert response.status_code == 403
+
+
+def test_fast_sampled_request_is_dropped(client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(profiling, "PROFILING_SLOW_MS", 60_000)
+
+    response = client.post("/api/chat", json={"messages": [], "user_id": "u1"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert profiling.get_recent_traces() == []
+
+
+def test_slow_sampled_request_is_kept(client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(profiling, "PROFILING_SLOW_MS", 0)
+
+    client.post("/api/chat", json={"messages": [], "user_id": "u1"})
+    [trace] = profiling.get_recent_traces()
+    assert trace['trigger'] == 'sample'
+
+
+def test_traces_limit_must_be_positive(client):
+    response = client.get("/api/debug/traces?limit=-3", headers={"X-Profile-Token": ADMIN_TOKEN})
+    assert response.status_code == 422
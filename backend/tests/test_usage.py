@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def completion_usage(prompt_tokens, completion_tokens):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+
+
+def test_record_aggregates_per_user_and_chat(usage, fake_db):
+    tracker = usage.UsageTracker(default_quota=0)
+    tracker.record("u1", "c1", "llama", completion_usage(10, 20), 100.0)
+    tracker.record("u1", "c1", "llama", completion_usage(5, 5), 50.0)
+
+    summary = asyncio.run(tracker.get_user_summary("u1"))
+    assert summary['requests'] == 2
+    assert summary['prompt_tokens'] == 15
+    assert summary['total_tokens'] == 40
+    assert summary['models'] == {'llama': {'requests': 2, 'total_tokens': 40}}
+    assert summary['quota'] is None
+
+    chat = asyncio.run(tracker.get_chat_summary("c1"))
+    assert chat['total_tokens'] == 40
+
+
+def test_check_quota_counts_stored_and_pending_tokens(usage, fake_db):
+    fake_db.users["u1"] = {'token_quota': 100}
+    fake_db.user_usage[("u1", usage.current_period())] = {'total_tokens': 70}
+    tracker = usage.UsageTracker(default_quota=0)
+
+    assert asyncio.run(tracker.check_quota("u1"))
+    tracker.record("u1", None, "llama", completion_usage(10, 20), 10.0)
+    assert not asyncio.run(tracker.check_quota("u1"))
+
+
+def test_quota_is_not_cached_when_user_read_fails(usage, fake_db):
+    tracker = usage.UsageTracker(default_quota=50)
+
+    assert asyncio.run(tracker.get_quota("u1")) == 50
+    fake_db.users["u1"] = {'token_quota': 0}
+    assert asyncio.run(tracker.get_quota("u1")) == 0
+
+
+def test_quota_is_refreshed_after_ttl(usage, fake_db):
+    fake_db.users["u1"] = {'token_quota': 100}
+    tracker = usage.UsageTracker(default_quota=0, cache_ttl=60)
+
+    assert asyncio.run(tracker.get_quota("u1")) == 100
+    fake_db.users["u1"] = {'token_quota': 200}
+    assert asyncio.run(tracker.get_quota("u1")) == 100
+    assert fake_db.user_reads == 1
+
+    tracker.cache_ttl = 0
+    assert asyncio.run(tracker.get_quota("u1")) == 200
+
+
+def test_flush_does_not_double_count(usage, fake_db):
+    tracker = usage.UsageTracker(default_quota=0)
+    period = usage.current_period()
+    tracker.record("u1", "c1", "llama", completion_usage(10, 20), 10.0)
+
+    assert asyncio.run(tracker.tokens_used("u1")) == 30
+    assert asyncio.run(tracker.flush())
+    assert fake_db.user_usage[("u1", period)]['total_tokens'] == 30
+    assert asyncio.run(tracker.tokens_used("u1")) == 30
+
+    # Nothing pending: a second flush writes nothing
+    assert asyncio.run(tracker.flush())
+    assert fake_db.user_usage[("u1", period)]['total_tokens'] == 30
+
+
+def test_flush_requeues_only_uncommitted_deltas(usage, fake_db):
+    tracker = usage.UsageTracker(default_quota=0)
+    period = usage.current_period()
+    fake_db.fail_keys = {('chat', 'c1')}
+    tracker.record("u1", "c1", "llama", completion_usage(10, 20), 10.0)
+
+    assert not asyncio.run(tracker.flush())
+    assert fake_db.user_usage[("u1", period)]['total_tokens'] == 30
+    assert "c1" not in fake_db.chat_usage
+
+    fake_db.fail_keys = set()
+    assert asyncio.run(tracker.flush())
+    assert fake_db.user_usage[("u1", period)]['total_tokens'] == 30
+    assert fake_db.chat_usage["c1"]['total_tokens'] == 30
+
+
+def test_flush_picks_up_usage_from_other_workers(usage, fake_db):
+    fake_db.users["u1"] = {'token_quota': 100}
+    tracker = usage.UsageTracker(default_quota=0)
+    period = usage.current_period()
+
+    assert asyncio.run(tracker.tokens_used("u1")) == 0
+    fake_db.user_usage[("u1", period)] = {'total_tokens': 90}
+    tracker.record("u1", None, "llama", completion_usage(5, 5), 10.0)
+    assert asyncio.run(tracker.flush())
+
+    assert asyncio.run(tracker.tokens_used("u1")) == 100
+    assert not asyncio.run(tracker.check_quota("u1"))
+
+
+def test_is_valid_period(usage):
+    assert usage.is_valid_period("2026-10")
+    assert not usage.is_valid_period("2026-10\n")
+    assert not usage.is_valid_period("2026-99")
+    assert not usage.is_valid_period("2026-10/x")
+    assert not usage.is_valid_period("x_2026-10")
+
+
+def test_flush_evicts_expired_cache_entries(usage, fake_db):
+    fake_db.users["u1"] = {'token_quota': 100}
+    tracker = usage.UsageTracker(default_quota=0, cache_ttl=60)
+    asyncio.run(tracker.check_quota("u1"))
+    assert tracker._quotas and tracker._stored_tokens
+
+    tracker.cache_ttl = 0
+    asyncio.run(tracker.flush())
+    assert not tracker._quotas
+    assert not tracker._stored_tokens
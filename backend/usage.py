@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+import logging
+from contextlib import suppress
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Monthly token allowance applied when a user has no `token_quota` of their own (0 = unlimited)
+DEFAULT_TOKEN_QUOTA = int(os.getenv("TOKEN_QUOTA_DEFAULT", "0"))
+# Seconds between writes of aggregated usage to Firestore
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "30"))
+# Seconds before cached quotas and stored totals are re-read from Firestore
+USAGE_CACHE_TTL = float(os.getenv("USAGE_CACHE_TTL", "60"))
+
+USAGE_COUNTERS = ('requests', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'latency_ms')
+
+
+def current_period() -> str:
+    return datetime.now().strftime("%Y-%m")
+
+
+def is_valid_period(period: str) -> bool:
+    """Return True for a real YYYY-MM month"""
+    if len(period) != 7:
+        return False
+    try:
+        datetime.strptime(period, "%Y-%m")
+        return True
+    except ValueError:
+        return False
+
+
+def _empty_totals() -> dict:
+    totals = {field: 0 for field in USAGE_COUNTERS}
+    totals['models'] = {}
+    return totals
+
+
+def _add(totals: dict, other: dict):
+    for field in USAGE_COUNTERS:
+        totals[field] += other.get(field, 0)
+    for model, counters in other.get('models', {}).items():
+        model_totals = totals['models'].setdefault(model, {'requests': 0, 'total_tokens': 0})
+        for field, value in counters.items():
+            model_totals[field] = model_totals.get(field, 0) + value
+
+
+class UsageTracker:
+    """
+    Aggregates Groq token usage per user (per month) and per chat in memory
+    and writes the deltas to Firestore in batches, so recording a completion
+    never costs an extra round trip on the request path.
+
+    Quotas are enforced per process: stored totals are cached for `cache_ttl`
+    seconds (and re-read after each flush), so usage recorded by other workers
+    is only seen once their deltas are flushed and the cache expires.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = USAGE_FLUSH_INTERVAL,
+        default_quota: int = DEFAULT_TOKEN_QUOTA,
+        cache_ttl: float = USAGE_CACHE_TTL,
+    ):
+        self.flush_interval = flush_interval
+        self.default_quota = default_quota
+        self.cache_ttl = cache_ttl
+        # Deltas not yet written to Firestore
+        self._pending_users: Dict[Tuple[str, str], dict] = {}
+        self._pending_chats: Dict[str, dict] = {}
+        # (value, loaded_at) for stored tokens per (user, period) and quota per user, loaded lazily
+        self._stored_tokens: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._quotas: Dict[str, Tuple[int, float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: str, chat_id: Optional[str], model: str, usage, latency_ms: float):
+        """Record the `usage` block of a single Groq completion"""
+        call = {
+            'requests': 1,
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            'total_tokens': getattr(usage, 'total_tokens', 0) or 0,
+            'latency_ms': round(latency_ms, 2),
+        }
+        call['models'] = {model: {'requests': 1, 'total_tokens': call['total_tokens']}}
+
+        _add(self._pending_users.setdefault((user_id, current_period()), _empty_totals()), call)
+        if chat_id:
+            chat_totals = self._pending_chats.setdefault(chat_id, dict(_empty_totals(), user_id=user_id))
+            _add(chat_totals, call)
+
+        logger.info(
+            f"Usage for user {user_id}: {call['prompt_tokens']} prompt + "
+            f"{call['completion_tokens']} completion tokens on {model} in {call['latency_ms']}ms"
+        )
+
+    def _evict_stale(self):
+        """Drop cache entries past their TTL so inactive users and past months don't pile up"""
+        for cache in (self._stored_tokens, self._quotas):
+            for key in [key for key, (_, loaded_at) in cache.items() if not self._is_fresh(loaded_at)]:
+                del cache[key]
+
+    async def flush(self) -> bool:
+        self._evict_stale()
+        if not self._pending_users and not self._pending_chats:
+            return True
+
+        user_usage, self._pending_users = self._pending_users, {}
+        chat_usage, self._pending_chats = self._pending_chats, {}
+
+        committed = await db.flush_usage(user_usage, chat_usage, USAGE_COUNTERS)
+
+        # Keep the deltas that weren't committed so the next flush retries them
+        for key, totals in user_usage.items():
+            if ('user', key) in committed:
+                # Re-read on the next check so other workers' usage is picked up too
+                self._stored_tokens.pop(key, None)
+            else:
+                _add(self._pending_users.setdefault(key, _empty_totals()), totals)
+        for chat_id, totals in chat_usage.items():
+            if ('chat', chat_id) not in committed:
+                _add(self._pending_chats.setdefault(chat_id, dict(_empty_totals(), user_id=totals['user_id'])), totals)
+
+        return len(committed) == len(user_usage) + len(chat_usage)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in usage flush loop: {str(e)}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+    def _is_fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.cache_ttl
+
+    async def _stored_user_tokens(self, user_id: str, period: str) -> int:
+        key = (user_id, period)
+        cached = self._stored_tokens.get(key)
+        if cached is None or not self._is_fresh(cached[1]):
+            stored = await db.get_user_usage(user_id, period)
+            if stored is None:
+                # Firestore unavailable: fall back to the last known total and retry on the next request
+                return cached[0] if cached else 0
+            cached = (stored.get('total_tokens', 0), time.monotonic())
+            self._stored_tokens[key] = cached
+        return cached[0]
+
+    async def get_quota(self, user_id: str) -> int:
+        cached = self._quotas.get(user_id)
+        if cached is None or not self._is_fresh(cached[1]):
+            user = await db.get_user(user_id)
+            if user is None:
+                # Read failed or the user isn't synced yet: don't cache, try again on the next request
+                return cached[0] if cached else self.default_quota
+            quota = user.get('token_quota')
+            cached = (int(quota) if quota is not None else self.default_quota, time.monotonic())
+            self._quotas[user_id] = cached
+        return cached[0]
+
+    async def tokens_used(self, user_id: str, period: Optional[str] = None) -> int:
+        period = period or current_period()
+        pending = self._pending_users.get((user_id, period))
+        return await self._stored_user_tokens(user_id, period) + (pending['total_tokens'] if pending else 0)
+
+    async def check_quota(self, user_id: str) -> bool:
+        """Return False once the user has used up this month's token quota"""
+        quota = await self.get_quota(user_id)
+        if quota <= 0:
+            return True
+        return await self.tokens_used(user_id) < quota
+
+    async def get_user_summary(self, user_id: str, period: Optional[str] = None) -> dict:
+        period = period or current_period()
+        totals = _empty_totals()
+        stored = await db.get_user_usage(user_id, period)
+        if stored:
+            _add(totals, stored)
+        pending = self._pending_users.get((user_id, period))
+        if pending:
+            _add(totals, pending)
+
+        quota = await self.get_quota(user_id)
+        return dict(
+            totals,
+            user_id=user_id,
+            period=period,
+            quota=quota or None,
+            remaining=max(quota - totals['total_tokens'], 0) if quota > 0 else None,
+        )
+
+    async def get_chat_summary(self, chat_id: str) -> dict:
+        totals = _empty_totals()
+        stored = await db.get_chat_usage(chat_id)
+        if stored:
+            _add(totals, stored)
+        pending = self._pending_chats.get(chat_id)
+        if pending:
+            _add(totals, pending)
+        return dict(totals, chat_id=chat_id)
+
+
+tracker = UsageTracker()